@@ -1,21 +1,240 @@
-import datetime
+import ctypes
 import logging
 import logging.handlers
+import os
 import psutil
-import queue
+import select
 import signal
+import stat
+import struct
 import subprocess
 import sys
 import time
+import types
 
 from anoptions import Parameter, Options
+from dataclasses import dataclass
 from enum import Enum
 
+# Lookup for all valid signals by name and by integer value (as string),
+# real-time signals without a Signals member are only found by value
+# The table is shared by all instances, so it is handed out read-only
+_lookup = {}
+for _sig in signal.valid_signals():
+  if isinstance(_sig, signal.Signals):
+    _lookup[_sig.name] = _sig
+  _lookup[str(int(_sig))] = _sig
+_SIGNAL_LOOKUP = types.MappingProxyType(_lookup)
+del _sig, _lookup
+
+# Signals ignored by the interpreter that subprocess.Popen resets for children
+_RESET_SIGNALS = tuple(getattr(signal, x) for x in ("SIGPIPE", "SIGXFZ", "SIGXFSZ") if hasattr(signal, x))
+
+
+def open_pidfd(pid):
+  # Will return a pidfd for pid, and None if not available
+  if pid is None or not hasattr(os, "pidfd_open"):
+    return None
+  try:
+    return os.pidfd_open(pid, 0)
+  except OSError:
+    return None
+
+
 class ExpectedOutcome(Enum):
   PROCESS_RUNNING = 1
   PROCESS_STOPPED = 2
 
 
+@dataclass
+class _ProcState:
+  # A cached psutil.Process, alive turns False for good once the process is gone
+  proc: psutil.Process
+  alive: bool = True
+
+
+class PidfileWatcher(object):
+  # Watches the directory of a pidfile with inotify and reports changes to the file
+  IN_MODIFY      = 0x00000002
+  IN_CLOSE_WRITE = 0x00000008
+  IN_MOVED_TO    = 0x00000080
+  IN_CREATE      = 0x00000100
+  IN_Q_OVERFLOW  = 0x00004000
+
+  EVENT = struct.Struct("iIII")
+
+  def __init__(self, pidfile, libc):
+    self.filename = os.fsencode(os.path.basename(pidfile))
+    self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    mask = self.IN_CREATE | self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+    path = os.fsencode(os.path.dirname(os.path.abspath(pidfile)))
+    if libc.inotify_add_watch(self.fd, path, mask) < 0:
+      errno = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(errno, "inotify_add_watch failed")
+
+
+  @classmethod
+  def open(cls, pidfile):
+    # Will return a watcher for pidfile, and None if inotify is not available
+    try:
+      libc = ctypes.CDLL(None, use_errno=True)
+      if not hasattr(libc, "inotify_init1"):
+        return None
+      return cls(pidfile, libc)
+    except OSError:
+      return None
+
+
+  def fileno(self):
+    return self.fd
+
+
+  def changed(self):
+    # Drains pending events, returns True if any of them concerned the pidfile
+    # or if events were dropped, as then we cannot tell whether it changed
+    result = False
+    while True:
+      try:
+        data = os.read(self.fd, 4096)
+      except BlockingIOError:
+        break
+      offset = 0
+      while offset < len(data):
+        _, mask, _, length = self.EVENT.unpack_from(data, offset)
+        offset += self.EVENT.size
+        name = data[offset:offset+length].rstrip(b"\0")
+        offset += length
+        if name == self.filename or mask & self.IN_Q_OVERFLOW:
+          result = True
+    return result
+
+
+  def close(self):
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+
+class SignalFd(object):
+  # Receives signals through a signalfd instead of Python level signal handlers
+  SIGSET_SIZE  = 128
+  SIGINFO_SIZE = 128
+
+  def __init__(self, signals, libc):
+    sigset = ctypes.create_string_buffer(self.SIGSET_SIZE)
+    libc.sigemptyset(sigset)
+    for sig in signals:
+      libc.sigaddset(sigset, int(sig))
+    # Blocked signals are queued to the signalfd instead of being delivered
+    self.signals = frozenset(signals)
+    signal.pthread_sigmask(signal.SIG_BLOCK, self.signals)
+    self.fd = libc.signalfd(-1, sigset, os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      errno = ctypes.get_errno()
+      signal.pthread_sigmask(signal.SIG_UNBLOCK, self.signals)
+      raise OSError(errno, "signalfd failed")
+
+
+  @classmethod
+  def open(cls, signals):
+    # Will return a signalfd for signals, and None if signalfd is not available
+    try:
+      libc = ctypes.CDLL(None, use_errno=True)
+      if not hasattr(libc, "signalfd"):
+        return None
+      return cls(signals, libc)
+    except OSError:
+      return None
+
+
+  def fileno(self):
+    return self.fd
+
+
+  def read(self):
+    # Drains pending signals, returns their numbers in arrival order
+    result = []
+    while True:
+      try:
+        data = os.read(self.fd, self.SIGINFO_SIZE*16)
+      except BlockingIOError:
+        break
+      for offset in range(0, len(data), self.SIGINFO_SIZE):
+        # ssi_signo is the first field of struct signalfd_siginfo
+        result.append(struct.unpack_from("I", data, offset)[0])
+    return result
+
+
+  def close(self):
+    # Unblocks the signals again, from here on they are delivered as usual
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+      signal.pthread_sigmask(signal.SIG_UNBLOCK, self.signals)
+
+
+class SpawnedProcess(object):
+  # Minimal subprocess.Popen lookalike for a child started with os.posix_spawn
+
+  # Return code of a child that has exited but was reaped by somebody else
+  STATUS_LOST = object()
+
+  def __init__(self, args, pid):
+    self.args = args
+    self.pid = pid
+    self.returncode = None
+
+
+  def poll(self):
+    if self.returncode is None:
+      try:
+        pid, status = os.waitpid(self.pid, os.WNOHANG)
+      except ChildProcessError:
+        # Somebody else reaped the child, its exit status is lost
+        self.returncode = self.STATUS_LOST
+        return self.returncode
+      if pid != 0:
+        self.returncode = os.waitstatus_to_exitcode(status)
+    return self.returncode
+
+
+  def wait(self, timeout=None):
+    if timeout is None:
+      while self.returncode is None:
+        try:
+          _, status = os.waitpid(self.pid, 0)
+          self.returncode = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+          self.returncode = self.STATUS_LOST
+      return self.returncode
+
+    deadline = time.monotonic()+timeout
+    delay = 0.0005
+    while self.poll() is None:
+      remaining = deadline-time.monotonic()
+      if remaining <= 0:
+        raise subprocess.TimeoutExpired(self.args, timeout)
+      delay = min(delay*2, remaining, 0.05)
+      time.sleep(delay)
+    return self.returncode
+
+
+  def send_signal(self, sig):
+    if self.returncode is None:
+      os.kill(self.pid, sig)
+
+
+  def terminate(self):
+    self.send_signal(signal.SIGTERM)
+
+
+  def kill(self):
+    self.send_signal(signal.SIGKILL)
+
+
 class DaemonManager(object):
   def __init__(self, config, logger):
     self.pidfile = config["pidfile"]
@@ -24,74 +243,246 @@ class DaemonManager(object):
     self.config = config
     self.logger = logger
 
-    self.signal_queue = queue.Queue()
+    self._proc_cache = {}
+    self._pid_memo = None
+
+    # All event sources (pidfds, inotify, signals) are waited on through one epoll
+    # instance, select() on the armed fds stands in for it where epoll is missing
+    self._epoll = select.epoll() if hasattr(select, "epoll") else None
+    self._armed = set()
+
+    # Command processes we have started, by pid, for handing over reaped exit statuses
+    self._children = {}
+
+    self.signalfd = None
+    self.signal_rfd = None
+    self.signal_wfd = None
     self.signal_commands = {}
-    self.exit_signals = [ signal.SIGINT, signal.SIGTERM ]
+    self.exit_signals = { signal.SIGINT, signal.SIGTERM }
 
     self.check_if_already_running()
     self.process_config()
 
 
-  @staticmethod
-  def get_process(pid):
-    # Will return psutil.Process for pid, and None if pid is not found
-    try:
-      p = psutil.Process(pid)
+  def get_process(self, pid):
+    # Will return _ProcState for pid, and None if pid is not found
+    # Process objects are cached for as long as the pid is alive
+    if pid is None:
+      return None
+    p = self._proc_cache.get(pid)
+    if p is not None:
       return p
+    try:
+      p = _ProcState(psutil.Process(pid))
     except psutil.NoSuchProcess:
       return None  
+    self._proc_cache[pid] = p
+    return p
 
 
   @staticmethod
   def file_exists(filename):
-    import os
-    return filename is not None and os.path.exists(filename) and os.path.isfile(filename)  
+    try:
+      st = os.stat(filename)
+    except (FileNotFoundError, TypeError):
+      return False
+    return stat.S_ISREG(st.st_mode)
 
 
   @staticmethod
-  def load_text(filename):
-    result = None
-    if filename == '-':
-      import sys
-      f = sys.stdin
-    else:
-      f = open(filename, 'r', encoding='utf8')
-    with f as file:
-      result = file.read()
-    return result
+  def read_pid(pidfile):
+    # Will return the pid in pidfile, and None if the file is missing or not fully written
+    # The pidfile is tiny, so skip the text mode file object and read it raw
+    try:
+      fd = os.open(pidfile, os.O_RDONLY)
+    except (OSError, TypeError):
+      return None
+    try:
+      data = os.read(fd, 32)
+    except OSError:
+      return None
+    finally:
+      os.close(fd)
+    try:
+      return int(data)
+    except ValueError:
+      return None
+
+
+  def _read_pidfile_cached(self, pidfile):
+    # Like read_pid, but only re-reads the file when stat shows it has changed
+    try:
+      st = os.stat(pidfile)
+    except (OSError, TypeError):
+      self._pid_memo = None
+      return None
+    key = (pidfile, st.st_mtime_ns, st.st_ino, st.st_size)
+    if self._pid_memo is not None and self._pid_memo[0] == key:
+      return self._pid_memo[1]
+    pid = self.read_pid(pidfile)
+    self._pid_memo = (key, pid)
+    return pid
 
 
   @staticmethod
-  def is_proc_running(proc):
-    # Will return True if psutil.Process is running
+  def _linux_is_running(pid):
+    # Will return True if pid is neither a zombie nor dead, reads the state
+    # field of /proc/<pid>/stat directly instead of going through psutil
     try:
-      if proc.is_running() is True and proc.status() != psutil.STATUS_ZOMBIE:
+      with open("/proc/{}/stat".format(pid), "rb") as f:
+        data = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+      return False
+    # The command name may contain spaces and parentheses, the state follows the last ')'
+    i = data.rfind(b")")
+    return data[i+2:i+3] not in (b"Z", b"X")
+
+
+  def is_proc_running(self, state):
+    # Will return True if the process of a _ProcState is running
+    if state is None or state.alive is False:
+      return False
+    if sys.platform.startswith("linux"):
+      if self._linux_is_running(state.proc.pid) is True:
         return True
-    except (psutil.NoSuchProcess):
-      pass
+    else:
+      try:
+        if state.proc.status() != psutil.STATUS_ZOMBIE:
+          return True
+      except (psutil.NoSuchProcess):
+        pass
+    # The process is gone for good, remember that and forget it
+    state.alive = False
+    self._proc_cache.pop(state.proc.pid, None)
     return False
 
 
+  def _arm(self, fd):
+    # (Re)arms fd for a single readiness event, re-arming an fd that is
+    # already readable reports it again on the next wait
+    if self._epoll is not None:
+      flags = select.EPOLLIN | select.EPOLLET | select.EPOLLONESHOT
+      if fd in self._armed:
+        self._epoll.modify(fd, flags)
+      else:
+        self._epoll.register(fd, flags)
+    self._armed.add(fd)
+
+
+  def _disarm(self, fd):
+    # Removes fd from the wait set, must be done before closing it
+    if fd in self._armed:
+      if self._epoll is not None:
+        self._epoll.unregister(fd)
+      self._armed.discard(fd)
+
+
+  def _wait_events(self, timeout):
+    # Waits up to timeout seconds (None for no limit) for the armed fds, returns
+    # the ones that became readable; they stay quiet until armed again
+    if self._epoll is not None:
+      ready = set(fd for fd, _ in self._epoll.poll(-1 if timeout is None else max(timeout, 0)))
+    else:
+      ready = set()
+      if timeout is not None:
+        timeout = max(timeout, 0)
+      if len(self._armed) > 0:
+        ready = set(select.select(list(self._armed), [], [], timeout)[0])
+      elif timeout is not None:
+        time.sleep(timeout)
+      # Emulate one-shot semantics, the fd must be re-armed to be waited on again
+      self._armed -= ready
+    self._reap_children()
+    return ready
+
+
+  def _reap_children(self):
+    # Reaps every exited child so none of them linger as zombies; when we run as
+    # pid 1 in a container this includes the daemon, orphaned by its start script
+    while True:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except ChildProcessError:
+        break
+      if pid == 0:
+        break
+      state = self._proc_cache.pop(pid, None)
+      if state is not None:
+        state.alive = False
+      child = self._children.pop(pid, None)
+      if child is not None:
+        child.returncode = os.waitstatus_to_exitcode(status)
+
+
+  def _wait_for_exit(self, pid, timeout):
+    # Waits up to timeout seconds for pid to exit, returns True if it did
+    if pid is None:
+      return True
+    deadline = time.monotonic()+timeout
+    # Without a pidfd (no kernel support, not permitted or already gone) poll instead
+    fd = open_pidfd(pid)
+    if fd is not None:
+      try:
+        while True:
+          self._arm(fd)
+          if fd in self._wait_events(deadline-time.monotonic()):
+            return True
+          if time.monotonic() >= deadline:
+            return False
+      finally:
+        self._disarm(fd)
+        os.close(fd)
+
+    proc = self.get_process(pid)
+    while self.is_proc_running(proc) is True:
+      if time.monotonic() >= deadline:
+        return False
+      time.sleep(0.5)
+    return True
+
+
+  def _wait_for_child(self, child, pidfd, timeout):
+    # Waits up to timeout seconds for a command process to exit, returns True if it did
+    # Its exit status is picked up by _reap_children() or by poll()
+    deadline = time.monotonic()+timeout
+    while child.poll() is None:
+      remaining = deadline-time.monotonic()
+      if remaining <= 0:
+        return False
+      if pidfd is not None:
+        self._arm(pidfd)
+        self._wait_events(remaining)
+      else:
+        self._wait_events(min(remaining, 0.05))
+    return True
+
+
   @staticmethod
-  def start_subprocess(command_string, **kwargs):
-    # Starts and returns a subprocess
+  def start_subprocess(argv, stdout=None):
+    # Starts and returns a subprocess for an argument list
+    # posix_spawn avoids copying our page tables the way fork() would
     try: 
-      subproc = subprocess.Popen(command_string.split(","), **kwargs)
+      if not hasattr(os, "posix_spawnp"):
+        return subprocess.Popen(argv, stdout=stdout)
+      file_actions = []
+      if stdout is not None and stdout.fileno() != 1:
+        file_actions.append((os.POSIX_SPAWN_DUP2, stdout.fileno(), 1))
+      # Children must not inherit our blocked signals or ignored SIGPIPE
+      pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=file_actions,
+                            setsigmask=(), setsigdef=_RESET_SIGNALS)
     except FileNotFoundError:
       return None
-    return subproc
+    return SpawnedProcess(argv, pid)
 
 
   def run_cmd_and_wait(self, cmd, pidfile, waittime, expected_outcome):
-    if self.file_exists(pidfile):
-      old_pid = int(self.load_text(pidfile).strip())
-    else:
-      old_pid = None
+    old_pid = self._read_pidfile_cached(pidfile)
 
-    dttimeout = datetime.datetime.now()+datetime.timedelta(seconds=waittime)
+    deadline = time.monotonic()+waittime
 
     proc = None
     new_pid = None
+    cmd_pidfd = None
     
     # Run the command (if we have one), None is an option here too
     # to enable checking an already started transition
@@ -99,75 +490,97 @@ class DaemonManager(object):
       cmd_subproc = self.start_subprocess(cmd, stdout=sys.stdout)
       if cmd_subproc is None:
         return False
-      cmd_proc = self.get_process(cmd_subproc.pid)
+      self._children[cmd_subproc.pid] = cmd_subproc
+      # Wake up immediately when the command process exits
+      cmd_pidfd = open_pidfd(cmd_subproc.pid)
     else:
       cmd_subproc = None
-      cmd_proc = None
-
-    # Wait for process to transition
-    while datetime.datetime.now() < dttimeout:
-
-      if expected_outcome == ExpectedOutcome.PROCESS_RUNNING:
-        r = cmd_subproc.poll()
-
-        # Look for a new pid in pidfile in case of restart
-        if new_pid is None and self.file_exists(pidfile):
-          pid = int(self.load_text(pidfile).strip())
-          if pid != old_pid or r is not None:
-            new_pid = pid
-
-      elif expected_outcome == ExpectedOutcome.PROCESS_STOPPED:
-        proc = self.get_process(old_pid)
-        if proc is None:
-          # Process is stopped
-          break
-
-      # Look for new process if we have the pid
-      if new_pid is not None:
-        proc = self.get_process(new_pid)
-        if proc is not None:
-          # Got the new process running
-          break
-
-      time.sleep(0.5)
-
-    # Check for timeout
-    if datetime.datetime.now() >= dttimeout:
-      return False
 
-    pid = None
- 
-    while datetime.datetime.now() < dttimeout:
-      if expected_outcome == ExpectedOutcome.PROCESS_RUNNING:
-        # Make sure process is running until "timeout"
-        if pid is None:
-          pid = int(self.load_text(pidfile).strip())
-
-        proc = self.get_process(old_pid)
-        if proc is None:
-          # Process is not running
+    try:
+      if expected_outcome == ExpectedOutcome.PROCESS_STOPPED:
+        # Wait for the old process to exit
+        if self._wait_for_exit(old_pid, deadline-time.monotonic()) is False:
           return False
 
       else:
-        if self.is_proc_running(cmd_proc) is False:
-          break
+        # Wake up immediately also when the pidfile changes
+        if cmd_pidfd is not None:
+          self._arm(cmd_pidfd)
+        watcher = PidfileWatcher.open(pidfile)
+        if watcher is not None:
+          self._arm(watcher.fileno())
 
-      time.sleep(0.5)
+        try:
+          started = False
+          pidfile_changed = True
+          cmd_exited = cmd_pidfd is None
+          r = None
+          # Wait for process to transition
+          while (remaining := deadline-time.monotonic()) > 0:
+            if r is None and cmd_exited:
+              # Reap the command process, its pidfd is not re-armed
+              r = cmd_subproc.poll()
+              if r is SpawnedProcess.STATUS_LOST:
+                self.logger.warning("Exit status of the command process was lost")
+              if r is not None:
+                # Once the command is done an unchanged pid is accepted too
+                pidfile_changed = True
+
+            # Look for a new pid in pidfile in case of restart
+            if new_pid is None and pidfile_changed:
+              pid = self._read_pidfile_cached(pidfile)
+              if pid is not None and (pid != old_pid or r is not None):
+                new_pid = pid
+
+            # Look for new process if we have the pid
+            if new_pid is not None:
+              proc = self.get_process(new_pid)
+              if self.is_proc_running(proc) is True:
+                # Got the new process running
+                started = True
+                break
+              # Stale pid, wait for the pidfile to be rewritten
+              new_pid = None
+
+            if watcher is not None and cmd_pidfd is not None:
+              ready = self._wait_events(remaining)
+            else:
+              ready = self._wait_events(min(remaining, 0.5))
+            cmd_exited = cmd_pidfd is None or cmd_pidfd in ready
+            pidfile_changed = watcher is None or watcher.fileno() in ready
+            if pidfile_changed and watcher is not None:
+              if watcher.changed():
+                self._pid_memo = None
+              self._arm(watcher.fileno())
+        finally:
+          if watcher is not None:
+            self._disarm(watcher.fileno())
+            watcher.close()
+
+        if started is False:
+          return False
 
-    # Ensure command process is or will be exited
-    if cmd_subproc is not None:
-      if self.is_proc_running(cmd_proc) is True:
-        self.logger.info("Command process is still running, sending SIGTERM")
-        cmd_subproc.terminate()
-        cmd_subproc.wait(timeout=3)
-      if self.is_proc_running(cmd_proc) is True:
-        self.logger.info("Command process is still running, sending SIGKILL")
-        cmd_subproc.kill()    
+      # Ensure command process is or will be exited, it gets the remaining time to finish
+      if cmd_subproc is not None:
+        if self._wait_for_child(cmd_subproc, cmd_pidfd, deadline-time.monotonic()) is False:
+          self.logger.info("Command process is still running, sending SIGTERM")
+          cmd_subproc.terminate()
+          if self._wait_for_child(cmd_subproc, cmd_pidfd, 3) is False:
+            self.logger.info("Command process is still running, sending SIGKILL")
+            cmd_subproc.kill()
+            cmd_subproc.wait()
+    finally:
+      if cmd_pidfd is not None:
+        self._disarm(cmd_pidfd)
+        os.close(cmd_pidfd)
+      if cmd_subproc is not None:
+        self._children.pop(cmd_subproc.pid, None)
 
     # We should know the outcome for a stopping process at this time
     if expected_outcome == ExpectedOutcome.PROCESS_STOPPED:
+      # An exited process may linger as a zombie until its parent reaps it
       proc = self.get_process(old_pid)
-      return (proc is None)
+      return (proc is None or self.is_proc_running(proc) is False)
 
     # Transition finished succesfully
     return True
@@ -177,40 +590,75 @@ class DaemonManager(object):
 
 
   def signal_handler(self, signum, frame):
-    sig = signal.Signals(signum)
-    self.logger.info('Signal {} detected'.format(sig.name))
-    self.signal_queue.put_nowait((sig, frame))
+    # Nothing to do here, the signal number has already been written to
+    # the wakeup fd and is picked up by the main loop
+    pass
+
+
+  def open_signal_pipe(self):
+    # Self-pipe for signals when signalfd is not available, the interpreter writes
+    # the signal number to it whenever a signal with a Python level handler arrives
+    self.signal_rfd, self.signal_wfd = os.pipe()
+    os.set_blocking(self.signal_rfd, False)
+    os.set_blocking(self.signal_wfd, False)
+    signal.set_wakeup_fd(self.signal_wfd)
+
+
+  def close_signal_pipe(self):
+    # Detaches the self-pipe from the interpreter and closes both ends
+    if self.signal_rfd is not None:
+      signal.set_wakeup_fd(-1)
+      os.close(self.signal_rfd)
+      os.close(self.signal_wfd)
+      self.signal_rfd = None
+      self.signal_wfd = None
+
+
+  def signal_source(self):
+    # Will return the fd to poll for incoming signals
+    if self.signalfd is not None:
+      return self.signalfd.fileno()
+    return self.signal_rfd
+
+
+  def read_signals(self):
+    # Drains pending signals, returns the received signals in arrival order
+    if self.signalfd is not None:
+      return [self.signal_lookup[str(x)] for x in self.signalfd.read()]
+
+    data = b""
+    while True:
+      try:
+        chunk = os.read(self.signal_rfd, 4096)
+      except BlockingIOError:
+        break
+      if not chunk:
+        break
+      data += chunk
+    return [self.signal_lookup[str(x)] for x in data]
 
 
   def get_pid_info(self):
-    if self.file_exists(self.pidfile):
-      pid = int(self.load_text(self.pidfile).strip())
-      return self.get_process(pid)
-    else:
-      return None
+    return self.get_process(self._read_pidfile_cached(self.pidfile))
 
 
   def check_if_already_running(self):
     if self.file_exists(self.pidfile):
       p = self.get_pid_info()
       if p is not None:
-        if p.name().lower() == self.processname:
+        if p.proc.name().lower() == self.processname:
           self.logger.info("Process in pidfile is already running -- exiting")
           sys.exit(1)
-      import os
       os.remove(self.pidfile)
       self.logger.info("Removed old pidfile")
 
 
   def process_config(self):
-    self.signal_lookup = {}
-    # Collect all valid signals into a lookup dict
-    for x in signal.valid_signals():
-      try:
-        self.signal_lookup[x.name] = x
-        self.signal_lookup[str(x.value)] = x
-      except AttributeError:
-        self.signal_lookup[str(x)] = x
+    self.signal_lookup = _SIGNAL_LOOKUP
+
+    # Commands are split into argument lists once, parameters are separated by commas
+    self.startcmd = self.config["startcmd"].split(",")
+    self.stopcmd = self.config["stopcmd"].split(",") if "stopcmd" in self.config else None
 
     # Parse passthrough-input for signal passthrough mappings
     self.passthroughmap = {}
@@ -223,20 +671,20 @@ class DaemonManager(object):
         if len(y) == 1:
           y.append(y[0]) 
         sig_in, sig_out = y
-        if sig_in in self.signal_lookup and sig_out in signal_lookup:
+        if sig_in in self.signal_lookup and sig_out in self.signal_lookup:
           self.passthroughmap[self.signal_lookup[sig_in]] = self.signal_lookup[sig_out]
         else:
           self.logger.critical("Invalid signal passthrough configuration (unknown signal) -- exiting")
         if self.signal_lookup[sig_in] == signal.SIGINT:
-          self.exit_signals.remove(signal.SIGINT)
-          self.logger.warn("Passthrough for SIGINT defined -- you will not be able to stop this program with Ctrl-C".format(sig_in))  
+          self.exit_signals.discard(signal.SIGINT)
+          self.logger.warn("Passthrough for SIGINT defined -- you will not be able to stop this program with Ctrl-C")
 
     if "stopcmd" in self.config:
       for sig in (signal.SIGTERM, signal.SIGINT):
-        if sig not in self.passthroughmap.keys():
-          self.signal_commands[sig] = self.config["stopcmd"] 
+        if sig not in self.passthroughmap:
+          self.signal_commands[sig] = self.stopcmd
         else:
-          self.logger.info("Passthrough for {} defined together with stopcmd -- will use passthrough".format(sig)) 
+          self.logger.info("Passthrough for %s defined together with stopcmd -- will use passthrough", sig)
 
     # Parse input for signals
     if "signals" in self.config:
@@ -249,43 +697,67 @@ class DaemonManager(object):
         sig, cmd = y
         if sig in self.signal_lookup:
           if self.signal_lookup[sig] in (signal.SIGKILL, signal.SIGTSTP):
-            self.logger.critical("Impossible to hook to signal {} -- exiting".format(sig)) 
+            self.logger.critical("Impossible to hook to signal %s -- exiting", sig)
             sys.exit(1)
-          if self.signal_lookup[sig] == signal.SIGTERM and "stopcmd" in d:
-            self.logger.warn("Both stopcmd and signalcmd for {} defined -- will use stopcmd".format(sig)) 
+          if self.signal_lookup[sig] == signal.SIGTERM and "stopcmd" in self.config:
+            self.logger.warn("Both stopcmd and signalcmd for %s defined -- will use stopcmd", sig)
             continue
           if self.signal_lookup[sig] == signal.SIGINT:
-            exit_signals.remove(signal.SIGINT)
-            self.logger.warn("Command for SIGINT defined -- you will not be able to stop this program with Ctrl-C".format(sig)) 
-          if self.signal_lookup[sig] in self.passthroughmap.keys():
-            self.logger.warn("Both passthrough and signalcmd for {} defined -- will use passthrough".format(sig))
+            self.exit_signals.discard(signal.SIGINT)
+            self.logger.warn("Command for SIGINT defined -- you will not be able to stop this program with Ctrl-C")
+          if self.signal_lookup[sig] in self.passthroughmap:
+            self.logger.warn("Both passthrough and signalcmd for %s defined -- will use passthrough", sig)
             continue 
-          self.signal_commands[self.signal_lookup[sig]] = cmd
+          self.signal_commands[self.signal_lookup[sig]] = cmd.split(",")
         else:
-          self.logger.critical("Unknown signal {} -- exiting".format(sig))  
+          self.logger.critical("Unknown signal %s -- exiting", sig)
           sys.exit(1)
 
-      # Register signals
-      for sig, cmd in self.signal_commands.items():
+    # The set of exit signals is final from here on
+    self.exit_signals = frozenset(self.exit_signals)
+
+    # Receive all handled signals through a signalfd, falling back to Python
+    # level handlers and a self-pipe where signalfd is not available
+    # Exit signals without a command or passthrough keep their default action
+    # SIGCHLD is included to reap exited children as soon as possible
+    handled = set(self.signal_commands) | set(self.passthroughmap) | { signal.SIGCHLD }
+    self.signalfd = SignalFd.open(handled)
+    if self.signalfd is None:
+      self.open_signal_pipe()
+      signal.signal(signal.SIGCHLD, self.signal_handler)
+
+    # Register signals
+    for sig, cmd in self.signal_commands.items():
+      if self.signalfd is None:
         signal.signal(sig, self.signal_handler)
-        self.logger.info("Registered signal {} with command '{}'".format(sig.name, cmd))
+      self.logger.info("Registered signal %s with command '%s'", sig.name, ",".join(cmd))
 
-      # Register passthrough mappings
-      for sig_in, sig_out in self.passthroughmap.items():
+    # Register passthrough mappings
+    for sig_in, sig_out in self.passthroughmap.items():
+      if self.signalfd is None:
         signal.signal(sig_in, self.signal_handler)
-        self.logger.info("Registered signal {} with passthrough using signal {}".format(sig_in.name, sig_out.name))
+      self.logger.info("Registered signal %s with passthrough using signal %s", sig_in.name, sig_out.name)
 
   def run(self):
+    # The configuration does not change after construction, keep it in locals
+    pidfile         = self.pidfile
+    waitstart       = self.config["waitstart"]
+    waitstop        = self.config["waitstop"]
+    passthroughmap  = self.passthroughmap
+    signal_commands = self.signal_commands
+    exit_signals    = self.exit_signals
+
     self.logger.info("Starting process")
+    started = time.monotonic()
     status = self.run_cmd_and_wait(
-      self.config["startcmd"],
-      self.pidfile,
-      self.config["waitstart"],
+      self.startcmd,
+      pidfile,
+      waitstart,
       ExpectedOutcome.PROCESS_RUNNING
     )
   
     if status is True:
-      self.logger.info("Process is running after {} seconds".format(self.config["waitstart"]))
+      self.logger.info("Process is running after %.1f seconds", time.monotonic()-started)
     else:
       self.logger.critical("Failed to start process -- exiting")
       sys.exit(1)
@@ -294,81 +766,152 @@ class DaemonManager(object):
       def __init__(self, cmd):
         self.cmd = cmd
 
-    main_pid  = None
-    main_proc = None
-    stopcmd   = None
+    # Only re-read the pidfile when it changes, if inotify is available
+    pidfile_watcher = PidfileWatcher.open(pidfile)
+
+    # Wait for signals, pidfile changes and main process exit in one place
+    signal_fd = self.signal_source()
+    self._arm(signal_fd)
+    if pidfile_watcher is not None:
+      self._arm(pidfile_watcher.fileno())
+
+    main_pid    = None
+    main_proc   = None
+    main_pidfd  = None
+    refresh_pid = True
+    stopcmd     = None
+    ready       = set()
     try:
       while True:
-        try:
-          sig, frame = self.signal_queue.get(block=True, timeout=1)
+        # Update pid and proc variables of the main process for the checker if needed
+        if pidfile_watcher is not None and pidfile_watcher.fileno() in ready:
+          if pidfile_watcher.changed():
+            self._pid_memo = None
+            refresh_pid = True
+          self._arm(pidfile_watcher.fileno())
+        if refresh_pid is True:
+          refresh_pid = False
+          pid = self._read_pidfile_cached(pidfile)
+          if pid is None and main_pid is not None:
+            # The pidfile is being rewritten (truncated before the write) or was
+            # removed, keep watching the current pid until it holds a new one
+            refresh_pid = pidfile_watcher is None
+          elif pid != main_pid:
+            main_pid = pid
+            main_proc = None
+            if main_pidfd is not None:
+              self._disarm(main_pidfd)
+              os.close(main_pidfd)
+            main_pidfd = open_pidfd(main_pid)
+            if main_pidfd is not None:
+              self._arm(main_pidfd)
+        if main_proc is None:
+          main_proc = self.get_process(main_pid)
+
+        # Here we check that our main process is still running
+        if self.is_proc_running(main_proc) is False:
+          self.logger.critical("Process exited unexpectedly")
+          sys.exit(1)
 
-          # Got a signal within the queue get timeout limits, let's process it
-          if sig in self.passthroughmap.keys():
-            self.logger.info("Passthrough signal as {}".format(self.passthroughmap[sig].name))
-            effective_signal = self.passthroughmap[sig]
-            main_proc.send_signal(effective_signal)
+        if pidfile_watcher is not None and main_pidfd is not None:
+          ready = self._wait_events(None)
+        else:
+          ready = self._wait_events(1)
+
+        if signal_fd not in ready:
+          continue
+
+        # Handle everything that arrived since the last wakeup in one go, a burst of
+        # the same signal is coalesced and an exit signal overrides the rest
+        # SIGCHLD only wakes us up so that exited children get reaped
+        signals = [ sig for sig in dict.fromkeys(self.read_signals())
+                    if sig != signal.SIGCHLD or sig in passthroughmap or sig in signal_commands ]
+        self._arm(signal_fd)
+        for sig in signals:
+          if passthroughmap.get(sig, sig) in exit_signals:
+            signals = [ sig ]
+            break
+
+        for sig in signals:
+          self.logger.info('Signal %s detected', sig.name)
+
+          if sig in passthroughmap:
+            effective_signal = passthroughmap[sig]
+            self.logger.info("Passthrough signal as %s", effective_signal.name)
+            main_proc.proc.send_signal(effective_signal)
             excmd = None
-          else:
+          elif sig in signal_commands:
             effective_signal = sig
-            excmd = self.signal_commands[sig]
-            self.logger.info("Run command: {}".format(excmd))
+            excmd = signal_commands[sig]
+            self.logger.info("Run command: %s", ",".join(excmd))
+          else:
+            # The default SIGINT handler also writes to the wakeup fd
+            continue
 
-          if effective_signal in self.exit_signals:
+          if effective_signal in exit_signals:
             raise StartExit(excmd)
 
           if excmd is not None:
             status = self.run_cmd_and_wait(
               excmd, 
-              self.pidfile,
-              self.config["waitstart"],
+              pidfile,
+              waitstart,
               ExpectedOutcome.PROCESS_RUNNING
             )
 
             if status is False:
               self.logger.critical("Command failed -- exiting")
               sys.exit(1)
-          
-          # Reset the main_pid to ensure that we refresh the process information
-          main_pid = None
-
-        except queue.Empty:
-          # No new signals
-          pass
-
-        # Update pid and proc variables of the main process for the checker if needed
-        if main_pid is None:
-          main_pid = int(self.load_text(self.pidfile).strip())
-          main_proc = None
-        if main_proc is None:
-          main_proc = self.get_process(main_pid)
 
-        # Here we check that our main process is still running
-        if self.is_proc_running(main_proc) is False:
-          self.logger.critical("Process exited unexpectedly")
-          sys.exit(1)
+            # The command's waits shared our epoll, re-arm to catch anything it swallowed
+            self._arm(signal_fd)
+            if pidfile_watcher is not None:
+              ready.add(pidfile_watcher.fileno())
+            if main_pidfd is not None:
+              self._arm(main_pidfd)
+          
+          # Re-read the pidfile to ensure that we refresh the process information
+          if pidfile_watcher is None:
+            refresh_pid = True
 
     except (KeyboardInterrupt, StartExit) as e:
       # We'll break out ouf the loop and continue with the soft exit procedure
       self.logger.info("Start exit procedure")
       if isinstance(e, StartExit):
         stopcmd = e.cmd
-      elif "stopcmd" in self.config:
-        stopcmd = self.config["stopcmd"] 
-
+      else:
+        stopcmd = self.stopcmd
+
+    if pidfile_watcher is not None:
+      self._disarm(pidfile_watcher.fileno())
+      pidfile_watcher.close()
+    if main_pidfd is not None:
+      self._disarm(main_pidfd)
+      os.close(main_pidfd)
+    # Release the signal source before the stop phase, closing the signalfd unblocks
+    # the signals so that ones arriving while we wait for the process to stop are not lost
+    self._disarm(signal_fd)
+    if self.signalfd is not None:
+      self.signalfd.close()
+    else:
+      self.close_signal_pipe()
 
     # Exit process; exit zero if all is ok and 1 if not
 
     status = self.run_cmd_and_wait(
       stopcmd, 
-      self.pidfile,
-      self.config["waitstop"],
+      pidfile,
+      waitstop,
       ExpectedOutcome.PROCESS_STOPPED
     )
 
+    if self._epoll is not None:
+      self._epoll.close()
+
     if status is False:
       self.logger.critical("Failed to end the process -- exiting")
       if main_proc is not None:
-        main_proc.send_signal(signal.SIGTERM)
+        main_proc.proc.send_signal(signal.SIGTERM)
       sys.exit(1)
 
     # Process ended ok
@@ -421,7 +964,6 @@ def main(argv):
   logger = logging.getLogger("dmgr")
   logger.setLevel(config["loglevel"])
 
-  import os
   if os.path.exists("/dev/log"):
     handler = logging.handlers.SysLogHandler(address="/dev/log")
     logger.addHandler(handler)
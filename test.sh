@@ -23,6 +23,12 @@ elif [ "$1" == "stop" ]; then
       break
     fi
   done
+
+elif [ "$1" == "reload" ]; then
+  # Finishes after a moment and leaves the pid unchanged, like a SIGHUP reload
+  echo "reloading"
+  sleep 0.3
+
 else
   echo "command missing"
 fi